@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class FileCache:
+    """LRU cache of file contents limited by the total size in bytes.
+
+    Entries are validated against the file modification time and size,
+    so a changed file is read from disk again.
+    """
+
+    def __init__(self, max_size, max_file_size):
+        self.max_size = max_size
+        self.max_file_size = min(max_file_size, max_size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, path, stat):
+        with self.__lock:
+            entry = self.__entries.get(path)
+            if entry is None or entry[0] != (stat.st_mtime, stat.st_size):
+                self.misses += 1
+                return
+
+            self.__entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def can_store(self, stat):
+        return 0 < stat.st_size <= self.max_file_size
+
+    def put(self, path, stat, content):
+        if not self.can_store(stat):
+            return
+
+        with self.__lock:
+            old_entry = self.__entries.pop(path, None)
+            if old_entry:
+                self.size -= len(old_entry[1])
+
+            while self.__entries and self.size + len(content) > self.max_size:
+                _, (_, evicted) = self.__entries.popitem(last=False)
+                self.size -= len(evicted)
+
+            self.__entries[path] = ((stat.st_mtime, stat.st_size), content)
+            self.size += len(content)
+
+    def load(self, path, stat=None):
+        """Read file into the cache. Return None if the file does not match stat."""
+        try:
+            if stat is None:
+                stat = os.stat(path)
+            if not self.can_store(stat):
+                return
+            with open(path, 'rb') as f:
+                content = f.read()
+        except IOError:
+            return
+
+        if len(content) != stat.st_size:
+            return
+
+        self.put(path, stat, content)
+        return content
+
+    def hot_paths(self):
+        """Return cached paths, most recently used first."""
+        with self.__lock:
+            return list(reversed(self.__entries))
+
+    def get_stats(self):
+        with self.__lock:
+            return {
+                'size': self.size,
+                'entries': len(self.__entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -1,11 +1,15 @@
+import json
 import logging
 import os
+import signal
+import tempfile
 from argparse import ArgumentParser
 from datetime import datetime
 from mimetypes import types_map
 from urllib.parse import unquote
 
-from tcp_server import TCPServer
+from tcp_server import TCPServer, inherited_listen_fd
+from virtual_host import MAX_URL_LENGTH as HOST_MAX_URL_LENGTH, load_virtual_hosts
 
 HOST = 'localhost'
 PORT = 8080
@@ -15,13 +19,26 @@ NEWLINE = ('\r\n', '\n')
 DEFAULT_DOCUMENT_ROOT = './'
 DEFAULT_WORKERS_COUNT = 5
 
+DRAIN_TIMEOUT = 60
+
+HOT_PATHS_ENV = 'SIMPLE_HTTP_SERVER_HOT_PATHS'
+
+
+class HTTPError(Exception):
+    def __init__(self, code, message=''):
+        super(HTTPError, self).__init__(code, message)
+        self.code = code
+        self.message = message
+
 
 class SimpleHTTPServer(TCPServer):
     server_version = 'SimpleHttpServer/1.0'
     http_version = 'HTTP/1.1'
     headers = ''
 
-    MAX_URL_LENGTH = 65537
+    allow_reuse_address = True
+
+    MAX_URL_LENGTH = HOST_MAX_URL_LENGTH + 1
 
     RESPONSES = {
         200: 'OK',
@@ -30,7 +47,8 @@ class SimpleHTTPServer(TCPServer):
         404: 'Not Found',
         405: 'Method Not Allowed',
         414: 'Request-URI Too Long',
-        500: 'Server Internal Error'
+        500: 'Server Internal Error',
+        505: 'HTTP Version Not Supported'
     }
 
     HTTP_METHODS = {
@@ -38,66 +56,78 @@ class SimpleHTTPServer(TCPServer):
         'HEAD': 'do_head'
     }
 
-    def __init__(self, server_address, document_root, workers_count):
-        super(SimpleHTTPServer, self).__init__(server_address, workers_count)
-        self.document_root = document_root
+    def __init__(self, server_address, virtual_hosts, workers_count, listen_fd=None):
+        super(SimpleHTTPServer, self).__init__(server_address, workers_count, listen_fd)
+        self.virtual_hosts = virtual_hosts
 
     def process_request(self, client_conn):
         status_line = self.read_status_line(client_conn)
         self.log_request(status_line)
 
-        if not status_line:
+        if not status_line.strip():
             return
 
-        request_info = self.parse_status_line(client_conn, status_line)
-        if not request_info:
-            return
+        if self.is_status_line_too_long(status_line):
+            # The rest of the request line is not read, so the host is unknown
+            headers = {}
+            virtual_host = self.virtual_hosts.default_host
+        else:
+            headers = self.read_headers(client_conn)
+            virtual_host = self.virtual_hosts.resolve(headers.get('host'))
 
-        if not request_info['method'] in self.HTTP_METHODS:
-            self.write_response(client_conn, 405, 'Method {} Not Allowed'.format(request_info['method']))
-            return
+        code = 500
+        try:
+            code = self.handle_http_request(client_conn, status_line, headers, virtual_host)
+        finally:
+            virtual_host.stats.record_request(code, client_conn.bytes_sent)
+
+    def handle_http_request(self, client_conn, status_line, headers, virtual_host):
+        try:
+            if self.is_status_line_too_long(status_line):
+                raise HTTPError(414)
+
+            request_info = self.parse_status_line(status_line)
 
-        headers = self.read_headers(client_conn)
+            if not request_info['method'] in self.HTTP_METHODS:
+                raise HTTPError(405, 'Method {} Not Allowed'.format(request_info['method']))
+
+            if len(request_info['target']) > virtual_host.max_url_length:
+                raise HTTPError(414)
+        except HTTPError as e:
+            return self.write_response(client_conn, e.code, e.message)
 
         method_name = self.HTTP_METHODS[request_info['method']]
         http_method = getattr(self, method_name)
-        http_method(client_conn, request_info['path'], headers)
+        return http_method(client_conn, request_info['path'], headers, virtual_host)
 
     def read_status_line(self, client_conn):
-        status_line = client_conn.read_line(self.MAX_URL_LENGTH).decode('UTF-8')
-        if len(status_line) > self.MAX_URL_LENGTH - 1:
-            self.write_response(client_conn, 414)
-            return
+        return client_conn.read_line(self.MAX_URL_LENGTH).decode('UTF-8')
 
-        return status_line
+    def is_status_line_too_long(self, status_line):
+        return len(status_line) > self.MAX_URL_LENGTH - 1
 
-    def parse_status_line(self, client_conn, line):
+    def parse_status_line(self, line):
         words = line.rstrip('\r\n').split()
-        if len(words):
-            method, target, version = words
-            path = os.path.normpath(unquote(target.split('?', 1)[0]))
-            if version[:5] != 'HTTP/':
-                self.write_response(client_conn, 400, "Bad request version {}".format(version))
-                return
-            try:
-                base_version_number = version.split('/', 1)[1]
-                version_number = base_version_number.split(".")
-                if len(version_number) != 2:
-                    raise ValueError
-                version_number = int(version_number[0]), int(version_number[1])
-            except (ValueError, IndexError):
-                self.write_response(client_conn, 400, "Bad request version {}".format(version))
-                return
+        if len(words) != 3:
+            raise HTTPError(400, 'Bad request syntax {}'.format(line.rstrip('\r\n')))
 
-            if version_number >= (2, 0):
-                self.write_response(client_conn, 505, "Invalid HTTP Version {}".format(base_version_number))
-                return
+        method, target, version = words
+        path = os.path.normpath(unquote(target.split('?', 1)[0]))
+        if version[:5] != 'HTTP/':
+            raise HTTPError(400, "Bad request version {}".format(version))
+        try:
+            base_version_number = version.split('/', 1)[1]
+            version_number = base_version_number.split(".")
+            if len(version_number) != 2:
+                raise ValueError
+            version_number = int(version_number[0]), int(version_number[1])
+        except (ValueError, IndexError):
+            raise HTTPError(400, "Bad request version {}".format(version))
 
-            return {'method': method, 'path': path}
-        elif not words:
-            return
-        else:
-            self.write_response(client_conn, 400, 'Bad request syntax {}'.format(line))
+        if version_number >= (2, 0):
+            raise HTTPError(505, "Invalid HTTP Version {}".format(base_version_number))
+
+        return {'method': method, 'target': target, 'path': path}
 
     def read_headers(self, client_conn):
         headers = {}
@@ -106,43 +136,55 @@ class SimpleHTTPServer(TCPServer):
             if not header or header in NEWLINE:
                 break
 
-            if header.find(':') < 0:
-                key, value = header.strip('\r\n').split(': ')
-                headers[key] = value
+            if header.find(':') >= 0:
+                key, value = header.strip('\r\n').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
             else:
-                headers[header] = ''
+                headers[header.strip('\r\n').lower()] = ''
 
         return headers
 
-    def do_get(self, client_conn, path, headers):
-        self.send_file(client_conn, path, True)
+    def do_get(self, client_conn, path, headers, virtual_host):
+        return self.send_file(client_conn, path, virtual_host, True)
 
-    def do_head(self, client_conn, path, headers):
-        self.send_file(client_conn, path, False)
+    def do_head(self, client_conn, path, headers, virtual_host):
+        return self.send_file(client_conn, path, virtual_host, False)
 
-    def send_file(self, client_conn, target, send_content):
+    def send_file(self, client_conn, target, virtual_host, send_content):
         if '..' in target.split(os.sep):
-            self.write_response(client_conn, 403)
-            return
+            return self.write_response(client_conn, 403)
 
-        target = os.path.join(self.document_root, target[1:])
+        target = os.path.join(virtual_host.document_root, target[1:])
         if os.path.isdir(target):
-            target = os.path.join(target, 'index.html')
+            target = os.path.join(target, virtual_host.index_file)
 
-        if not os.path.exists(target):
-            self.write_response(client_conn, 404)
-            return
+        try:
+            stat = os.stat(target)
+        except OSError:
+            return self.write_response(client_conn, 404)
 
         self.send_status_line(client_conn, 200)
         self.send_common_headers(client_conn)
-        self.send_header(client_conn, 'Content-Length', str(os.path.getsize(target)))
+        self.send_header(client_conn, 'Content-Length', str(stat.st_size))
         self.send_header(client_conn, 'Content-Type', self.get_content_type(target))
         self.end_headers(client_conn)
 
         if send_content:
-            self.send_file_content(client_conn, target)
+            self.send_file_content(client_conn, target, stat, virtual_host.cache)
+
+        return 200
+
+    def send_file_content(self, client_conn, target, stat, cache):
+        content = None
+        if cache.can_store(stat):
+            content = cache.get(target, stat)
+            if content is None:
+                content = cache.load(target, stat)
+
+        if content is not None:
+            client_conn.write_data(content)
+            return
 
-    def send_file_content(self, client_conn, target):
         f = None
         try:
             try:
@@ -163,6 +205,7 @@ class SimpleHTTPServer(TCPServer):
         self.send_status_line(client_conn, code, message)
         self.send_common_headers(client_conn)
         self.end_headers(client_conn)
+        return code
 
     def send_status_line(self, client_conn, code, message=''):
         client_conn.write_line('{} {} {}'.format(self.http_version, code, message or self.RESPONSES[code]))
@@ -181,18 +224,74 @@ class SimpleHTTPServer(TCPServer):
     def log_request(self, status_request_line):
         logging.info('Request received: {}'.format(status_request_line.rstrip('\r\n')))
 
+    def log_stats(self, *args):
+        logging.info('Virtual hosts statistics: {}'.format(json.dumps(self.virtual_hosts.get_stats())))
+
+    def spawn_successor(self, args, env=None):
+        """Pass hot paths of file caches to the new generation to warm up its caches."""
+        fd, hot_paths_file = tempfile.mkstemp(prefix='httpd-hot-paths-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.virtual_hosts.get_hot_paths(), f)
+
+        env = dict(env or {})
+        env[HOT_PATHS_ENV] = hot_paths_file
+        successor = None
+        try:
+            successor = super(SimpleHTTPServer, self).spawn_successor(args, env)
+        finally:
+            if not successor and os.path.exists(hot_paths_file):
+                os.remove(hot_paths_file)
+
+        return successor
+
+    def warm_up(self):
+        hot_paths_file = os.environ.pop(HOT_PATHS_ENV, None)
+        if not hot_paths_file:
+            return
+
+        try:
+            with open(hot_paths_file) as f:
+                hot_paths = json.load(f)
+        except (IOError, ValueError):
+            logging.exception('Could not read hot paths from {}'.format(hot_paths_file))
+            return
+        finally:
+            if os.path.exists(hot_paths_file):
+                os.remove(hot_paths_file)
+
+        self.virtual_hosts.warm_up(hot_paths)
+        logging.info('File caches warmed up: {}'.format(json.dumps(self.virtual_hosts.get_stats())))
+
 
 def get_config_params():
     parser = ArgumentParser()
     parser.add_argument("--r", default=DEFAULT_DOCUMENT_ROOT)
     parser.add_argument("--w", default=DEFAULT_WORKERS_COUNT)
+    parser.add_argument("--c", default=None)
+    parser.add_argument("--p", default=None)
 
     try:
         w = int(parser.parse_args().w)
     except ValueError:
         w = DEFAULT_WORKERS_COUNT
 
-    return parser.parse_args().r, w
+    return parser.parse_args().r, w, parser.parse_args().c, parser.parse_args().p
+
+
+def write_pid_file(pid_file):
+    with open(pid_file, 'w') as f:
+        f.write('{}\n'.format(os.getpid()))
+
+
+def remove_pid_file(pid_file):
+    """Remove pid file unless it was already rewritten by the next server generation."""
+    try:
+        with open(pid_file) as f:
+            if f.read().strip() != str(os.getpid()):
+                return
+        os.remove(pid_file)
+    except (IOError, ValueError):
+        pass
 
 
 if __name__ == "__main__":
@@ -200,12 +299,31 @@ if __name__ == "__main__":
                         datefmt='%Y.%m.%d %H:%M:%S', level=logging.INFO)
     logging.info("Starting server at {}".format(PORT))
 
-    document_root, workers_count = get_config_params()
-
-    server = SimpleHTTPServer((HOST, PORT), document_root, workers_count)
+    document_root, workers_count, config_path, pid_file = get_config_params()
+    virtual_hosts = load_virtual_hosts(config_path, document_root)
+
+    server = SimpleHTTPServer((HOST, PORT), virtual_hosts, workers_count, inherited_listen_fd())
+    server.warm_up()
+    if pid_file:
+        write_pid_file(pid_file)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, server.log_stats)
+    for signal_name in ('SIGHUP', 'SIGUSR2'):
+        if hasattr(signal, signal_name):
+            signal.signal(getattr(signal, signal_name), server.start_reload)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
     finally:
         server.server_close()
+        logging.info('Stopped accepting connections, waiting up to {} seconds for requests to finish'
+                     .format(DRAIN_TIMEOUT))
+        drained = server.drain(DRAIN_TIMEOUT)
+        server.log_stats()
+        if pid_file:
+            remove_pid_file(pid_file)
+        if not drained:
+            logging.warning('Requests were not finished in {} seconds, exiting'.format(DRAIN_TIMEOUT))
+            logging.shutdown()
+            os._exit(1)
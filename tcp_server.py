@@ -1,9 +1,23 @@
 import logging
+import os
+import select
+import selectors
 import shutil
 import socket
+import subprocess
+import sys
 import threading
 from concurrent.futures import ThreadPoolExecutor
 
+LISTEN_FD_ENV = 'TCP_SERVER_LISTEN_FD'
+READY_FD_ENV = 'TCP_SERVER_READY_FD'
+
+
+def inherited_listen_fd():
+    """Return listening socket descriptor passed by the previous server generation."""
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    return int(listen_fd) if listen_fd else None
+
 
 class TCPServer:
     address_family = socket.AF_INET
@@ -13,20 +27,32 @@ class TCPServer:
 
     allow_reuse_address = False
 
-    def __init__(self, server_address, workers_count):
+    successor_ready_timeout = 30
+
+    def __init__(self, server_address, workers_count, listen_fd=None):
         self.server_address = server_address
         self.workers_count = workers_count
         self.__is_shut_down = threading.Event()
         self.__shutdown_request = False
+        self.__serving = False
+        self.__reload_lock = threading.Lock()
+        self.__active_requests = 0
+        self.__requests_done = threading.Condition()
 
-        self.socket = socket.socket(self.address_family,
-                                    self.socket_type)
+        self.inherited_socket = listen_fd is not None
+        if self.inherited_socket:
+            self.socket = socket.socket(fileno=listen_fd)
+            self.server_address = self.socket.getsockname()
+        else:
+            self.socket = socket.socket(self.address_family,
+                                        self.socket_type)
 
         self.executor = ThreadPoolExecutor(max_workers=workers_count)
 
     def bind_and_activate(self):
         try:
-            self.server_bind()
+            if not self.inherited_socket:
+                self.server_bind()
             self.server_activate()
         except Exception:
             self.server_close()
@@ -40,21 +66,39 @@ class TCPServer:
 
     def server_activate(self):
         self.socket.listen(self.request_queue_size)
+        # The listening socket may be shared with another server generation,
+        # so a connection signalled by select may be already accepted there.
+        self.socket.setblocking(False)
 
-    def serve_forever(self):
+    def serve_forever(self, poll_interval=0.5):
         self.bind_and_activate()
+        self.notify_ready()
 
         self.__is_shut_down.clear()
+        self.__serving = True
         try:
-            while not self.__shutdown_request:
-                try:
-                    conn, client_address = self.socket.accept()
-                except socket.error:
-                    self.handle_error(None)
-                    continue
-
-                self.executor.submit(self.handle_request, (conn, client_address))
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.socket, selectors.EVENT_READ)
+
+                while not self.__shutdown_request:
+                    if not selector.select(poll_interval):
+                        continue
+
+                    try:
+                        conn, client_address = self.socket.accept()
+                    except BlockingIOError:
+                        continue
+                    except socket.error:
+                        self.handle_error(None)
+                        continue
+
+                    # Accepted socket may inherit non-blocking mode of the listening socket on some systems
+                    conn.setblocking(True)
+                    with self.__requests_done:
+                        self.__active_requests += 1
+                    self.executor.submit(self.handle_request, (conn, client_address))
         finally:
+            self.__serving = False
             self.__shutdown_request = False
             self.__is_shut_down.set()
 
@@ -65,6 +109,77 @@ class TCPServer:
         self.__shutdown_request = True
         self.__is_shut_down.wait()
 
+    def drain(self, timeout=None):
+        """Wait until accepted requests are processed. Return False on timeout."""
+        with self.__requests_done:
+            drained = self.__requests_done.wait_for(lambda: not self.__active_requests, timeout)
+
+        if drained:
+            self.executor.shutdown()
+        return drained
+
+    def start_reload(self, *args):
+        """Reload in a separate thread so it may be used as a signal handler."""
+        threading.Thread(target=self.reload).start()
+
+    def reload(self):
+        """Start a new server generation on the same listening socket.
+
+        The new generation is the same command line run again. Once it is ready
+        to accept connections this server stops accepting and serve_forever returns.
+        """
+        if not self.__reload_lock.acquire(blocking=False):
+            return
+
+        try:
+            # The server that already handed the socket over may still be draining requests
+            if not self.__serving or self.__shutdown_request or self.socket.fileno() == -1:
+                return
+
+            logging.info('Starting new server generation')
+            successor = self.spawn_successor([sys.executable] + sys.argv)
+            if successor:
+                logging.info('New server generation (pid {}) is ready, stop accepting connections'
+                             .format(successor.pid))
+                self.shutdown()
+            else:
+                logging.error('New server generation failed to start, continue serving')
+        finally:
+            self.__reload_lock.release()
+
+    def spawn_successor(self, args, env=None):
+        """Run args with the listening socket. Return the process once it is ready or None."""
+        listen_fd = self.socket.fileno()
+        ready_r, ready_w = os.pipe()
+
+        successor_env = dict(os.environ)
+        successor_env.update(env or {})
+        successor_env[LISTEN_FD_ENV] = str(listen_fd)
+        successor_env[READY_FD_ENV] = str(ready_w)
+
+        try:
+            process = subprocess.Popen(args, env=successor_env, pass_fds=(listen_fd, ready_w))
+        except (OSError, ValueError):
+            os.close(ready_r)
+            self.handle_error(None)
+            return
+        finally:
+            os.close(ready_w)
+
+        with os.fdopen(ready_r, 'rb') as ready:
+            readable, _, _ = select.select([ready], [], [], self.successor_ready_timeout)
+            if readable and ready.read(1):
+                return process
+
+        process.kill()
+        process.wait()
+
+    def notify_ready(self):
+        ready_fd = os.environ.pop(READY_FD_ENV, None)
+        if ready_fd:
+            with os.fdopen(int(ready_fd), 'wb') as ready:
+                ready.write(b'1')
+
     def handle_request(self, params):
         request = TCPClientConnection(params[0], params[1])
         try:
@@ -73,6 +188,9 @@ class TCPServer:
             self.handle_error(params[1])
         finally:
             request.close()
+            with self.__requests_done:
+                self.__active_requests -= 1
+                self.__requests_done.notify_all()
 
     def process_request(self, request):
         """Process request and send answer if need. May be overridden.
@@ -96,6 +214,7 @@ class TCPClientConnection:
     def __init__(self, conn, client_address):
         self.connection = conn
         self.client_address = client_address
+        self.bytes_sent = 0
         self.rfile = self.connection.makefile('rb', self.rbufsize)
         self.wfile = self.connection.makefile('wb', self.wbufsize)
 
@@ -103,15 +222,18 @@ class TCPClientConnection:
         return self.rfile.readline(size)
 
     def write_line(self, line):
-        if line:
-            self.wfile.write(line.encode('UTF-8'))
-        self.wfile.write('\r\n'.encode('UTF-8'))
+        self.write_data((line + '\r\n').encode('UTF-8'))
 
     def write_message(self, message):
-        self.wfile.write(message.encode('UTF-8'))
+        self.write_data(message.encode('UTF-8'))
+
+    def write_data(self, data):
+        self.wfile.write(data)
+        self.bytes_sent += len(data)
 
     def write_file(self, f):
         shutil.copyfileobj(f, self.wfile)
+        self.bytes_sent += f.tell()
 
     def shutdown_request(self):
         try:
@@ -0,0 +1,153 @@
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from tcp_server import LISTEN_FD_ENV, READY_FD_ENV, TCPServer, inherited_listen_fd
+
+ONE_REQUEST_SERVER = '''
+import sys
+import threading
+sys.path.insert(0, {path!r})
+from tcp_server import TCPServer, inherited_listen_fd
+
+
+class OneRequestServer(TCPServer):
+    def process_request(self, request):
+        request.write_line('new generation')
+        threading.Thread(target=self.shutdown).start()
+
+
+server = OneRequestServer(None, 1, inherited_listen_fd())
+server.serve_forever(0.05)
+server.server_close()
+server.drain(5)
+'''.format(path=os.path.dirname(os.path.abspath(__file__)))
+
+
+class SlowTCPServer(TCPServer):
+    def __init__(self):
+        super(SlowTCPServer, self).__init__(('localhost', 0), 2)
+        self.request_started = threading.Event()
+        self.finish_request = threading.Event()
+        self.successor_calls = []
+        self.successor = None
+
+    def process_request(self, request):
+        self.request_started.set()
+        self.finish_request.wait(5)
+
+    def spawn_successor(self, args, env=None):
+        self.successor_calls.append(args)
+        return self.successor
+
+
+class TCPServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = SlowTCPServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+        while self.server.server_address[1] == 0:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.finish_request.set()
+        if self.thread.is_alive():
+            self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.server.drain(5)
+
+    def connect(self):
+        conn = socket.create_connection(self.server.server_address)
+        self.addCleanup(conn.close)
+        self.assertTrue(self.server.request_started.wait(5))
+
+    def test_shutdown_without_connections(self):
+        self.server.shutdown()
+        self.thread.join(1)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_drain_without_requests(self):
+        self.server.shutdown()
+        self.assertTrue(self.server.drain(0))
+
+    def test_drain(self):
+        self.connect()
+        self.server.shutdown()
+        self.server.server_close()
+
+        self.assertFalse(self.server.drain(0.1))
+        self.server.finish_request.set()
+        self.assertTrue(self.server.drain(5))
+
+    def test_reload_failure_keeps_serving(self):
+        self.server.reload()
+        self.assertEqual(len(self.server.successor_calls), 1)
+
+        self.connect()
+        self.assertTrue(self.thread.is_alive())
+
+    def test_reload(self):
+        self.server.successor = SimpleNamespace(pid=1)
+        self.server.reload()
+        self.thread.join(1)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_reload_after_shutdown(self):
+        self.server.shutdown()
+        self.server.reload()
+        self.server.server_close()
+        self.server.reload()
+        self.assertEqual(self.server.successor_calls, [])
+
+
+class SpawnSuccessorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = TCPServer(('localhost', 0), 1)
+
+    def tearDown(self):
+        self.server.server_close()
+        self.server.drain(5)
+
+    def test_inherited_listen_fd(self):
+        self.server.bind_and_activate()
+        os.environ[LISTEN_FD_ENV] = str(os.dup(self.server.socket.fileno()))
+
+        server = TCPServer(None, 1, inherited_listen_fd())
+        self.addCleanup(server.drain, 5)
+        self.addCleanup(server.server_close)
+
+        self.assertNotIn(LISTEN_FD_ENV, os.environ)
+        self.assertEqual(server.server_address, self.server.server_address)
+
+    def test_successor_serves_inherited_socket(self):
+        self.server.bind_and_activate()
+        successor = self.server.spawn_successor([sys.executable, '-c', ONE_REQUEST_SERVER])
+        self.assertIsNotNone(successor)
+
+        with socket.create_connection(self.server.server_address, timeout=5) as conn:
+            self.assertEqual(conn.makefile('rb').readline(), b'new generation\r\n')
+        self.assertEqual(successor.wait(5), 0)
+
+    def test_ready(self):
+        successor = self.server.spawn_successor([sys.executable, '-c', (
+            'import os; os.write(int(os.environ["{}"]), b"1")'.format(READY_FD_ENV))])
+        self.assertIsNotNone(successor)
+        self.assertEqual(successor.wait(5), 0)
+
+    def test_exit_without_ready(self):
+        self.assertIsNone(self.server.spawn_successor([sys.executable, '-c', 'pass']))
+
+    def test_ready_timeout(self):
+        self.server.successor_ready_timeout = 0.2
+        started = time.time()
+        self.assertIsNone(self.server.spawn_successor([sys.executable, '-c', 'import time; time.sleep(10)']))
+        self.assertLess(time.time() - started, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,305 @@
+import os
+import socket
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from file_cache import FileCache
+from httpd import HOT_PATHS_ENV, SimpleHTTPServer
+from tcp_server import TCPClientConnection, TCPServer
+from virtual_host import MAX_URL_LENGTH, VirtualHost, VirtualHostMap, load_virtual_hosts
+
+
+class VirtualHostMapTest(unittest.TestCase):
+    def setUp(self):
+        self.default_host = VirtualHost('*', './')
+        self.example_host = VirtualHost('example.com', '/var/www/example', aliases=['www.example.com'])
+        self.hosts = VirtualHostMap(self.default_host, [self.example_host])
+
+    def test_resolve_by_name(self):
+        self.assertIs(self.hosts.resolve('example.com'), self.example_host)
+
+    def test_resolve_by_alias_with_port(self):
+        self.assertIs(self.hosts.resolve('WWW.Example.com:8080'), self.example_host)
+
+    def test_unknown_host(self):
+        self.assertIs(self.hosts.resolve('unknown.com'), self.default_host)
+        self.assertIs(self.hosts.resolve('[::1]:8080'), self.default_host)
+
+    def test_no_host(self):
+        self.assertIs(self.hosts.resolve(None), self.default_host)
+
+    def test_duplicate_name(self):
+        with self.assertRaises(ValueError):
+            self.hosts.add(VirtualHost('www.example.com', './'))
+
+
+class LoadVirtualHostsTest(unittest.TestCase):
+    def test_load_config(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as f:
+            f.write('[DEFAULT]\n'
+                    'cache_size = 1024\n'
+                    'max_url_length = 100000\n'
+                    '[example.com]\n'
+                    'aliases = www.example.com example.org\n'
+                    'document_root = /var/www/example\n'
+                    'index = index.htm\n')
+        try:
+            hosts = load_virtual_hosts(f.name, './')
+        finally:
+            os.remove(f.name)
+
+        host = hosts.resolve('example.org')
+        self.assertEqual(host.document_root, '/var/www/example')
+        self.assertEqual(host.index_file, 'index.htm')
+        self.assertEqual(host.cache.max_size, 1024)
+        self.assertEqual(hosts.default_host.document_root, './')
+        self.assertEqual(hosts.default_host.cache.max_size, 1024)
+        self.assertEqual(host.max_url_length, MAX_URL_LENGTH)
+
+    def test_default_section_not_inherited_for_names(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as f:
+            f.write('[DEFAULT]\n'
+                    'aliases = shared.com\n'
+                    'document_root = /var/www/shared\n'
+                    '[example.com]\n'
+                    'document_root = /var/www/100%\n'
+                    '[example.org]\n'
+                    'document_root = /var/www/example.org\n')
+        try:
+            hosts = load_virtual_hosts(f.name, './')
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(hosts.resolve('example.com').document_root, '/var/www/100%')
+        self.assertEqual(hosts.resolve('example.org').aliases, ())
+        self.assertIs(hosts.resolve('shared.com'), hosts.default_host)
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = FileCache(10, 6)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_file(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_load_and_get(self):
+        path = self.make_file('a', b'aaaa')
+        self.assertEqual(self.cache.load(path), b'aaaa')
+        self.assertEqual(self.cache.get(path, os.stat(path)), b'aaaa')
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+
+    def test_file_too_large(self):
+        path = self.make_file('a', b'a' * 7)
+        self.assertIsNone(self.cache.load(path))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_eviction(self):
+        first = self.make_file('a', b'aaaa')
+        second = self.make_file('b', b'bbbb')
+        third = self.make_file('c', b'cccc')
+        self.cache.load(first)
+        self.cache.load(second)
+        self.cache.get(first, os.stat(first))
+        self.cache.load(third)
+        self.assertEqual(self.cache.hot_paths(), [third, first])
+        self.assertEqual(self.cache.size, 8)
+
+    def test_load_changed_file(self):
+        path = self.make_file('a', b'aaaa')
+        stat = os.stat(path)
+        self.make_file('a', b'aaaaa')
+        self.assertIsNone(self.cache.load(path, stat))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_changed_file(self):
+        path = self.make_file('a', b'aaaa')
+        self.cache.load(path)
+        self.make_file('a', b'aaaaa')
+        self.assertIsNone(self.cache.get(path, os.stat(path)))
+
+
+class WarmUpTest(unittest.TestCase):
+    def test_warm_up(self):
+        with tempfile.TemporaryDirectory() as root:
+            paths = []
+            for name in ('a', 'b', 'c'):
+                paths.append(os.path.join(root, name))
+                with open(paths[-1], 'wb') as f:
+                    f.write(b'data')
+
+            host = VirtualHost('example.com', root, cache_size=8)
+            host.warm_up(paths + ['/etc/hostname'])
+
+            self.assertEqual(host.cache.hot_paths(), paths[:2])
+
+
+class VirtualHostRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.default_root = tempfile.TemporaryDirectory()
+        self.example_root = tempfile.TemporaryDirectory()
+        self.make_file(self.default_root.name, 'index.html', b'default')
+        self.make_file(self.example_root.name, 'index.htm', b'example')
+
+        self.default_host = VirtualHost('*', self.default_root.name)
+        self.example_host = VirtualHost('example.com', self.example_root.name, index_file='index.htm',
+                                        max_url_length=20)
+        self.server = SimpleHTTPServer(('localhost', 0), VirtualHostMap(self.default_host, [self.example_host]), 1)
+
+    def tearDown(self):
+        self.server.socket.close()
+        self.server.executor.shutdown()
+        self.default_root.cleanup()
+        self.example_root.cleanup()
+
+    def make_file(self, root, name, content):
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(content)
+
+    def request(self, request):
+        client, server = socket.socketpair()
+        with client:
+            client.sendall(request)
+            client.shutdown(socket.SHUT_WR)
+
+            client_conn = TCPClientConnection(server, None)
+            try:
+                self.server.process_request(client_conn)
+            finally:
+                client_conn.close()
+
+            response = b''
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    return response
+                response += data
+
+    def test_read_headers(self):
+        client, server = socket.socketpair()
+        with client:
+            client.sendall(b'HOST: example.com:8080\r\nX-Empty:\r\n\r\n')
+            client_conn = TCPClientConnection(server, None)
+            headers = self.server.read_headers(client_conn)
+            client_conn.close()
+
+        self.assertEqual(headers, {'host': 'example.com:8080', 'x-empty': ''})
+
+    def test_route_by_host(self):
+        response = self.request(b'GET / HTTP/1.1\r\nHost: Example.com\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(response.endswith(b'\r\n\r\nexample'))
+
+        stats = self.example_host.get_stats()
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['bytes_sent'], len(response))
+        self.assertEqual(stats['status_codes'], {200: 1})
+        self.assertEqual(self.default_host.get_stats()['requests'], 0)
+
+    def test_unknown_host(self):
+        response = self.request(b'GET / HTTP/1.1\r\nHost: unknown.com\r\n\r\n')
+        self.assertTrue(response.endswith(b'\r\n\r\ndefault'))
+        self.assertEqual(self.default_host.get_stats()['status_codes'], {200: 1})
+
+    def test_cached_content(self):
+        first = self.request(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.make_file(self.example_root.name, 'index.htm', b'changed')
+        os.utime(os.path.join(self.example_root.name, 'index.htm'), (0, 0))
+        second = self.request(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+
+        self.assertTrue(first.endswith(b'example'))
+        self.assertTrue(second.endswith(b'changed'))
+        self.assertEqual(self.example_host.cache.get_stats()['misses'], 2)
+
+        self.request(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.assertEqual(self.example_host.cache.get_stats()['hits'], 1)
+
+    def test_error_responses_counted(self):
+        self.request(b'POST / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.request(b'GET /?' + b'a' * 100 + b' HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.request(b'GET /absent HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.request(b'GET / HTTP/2.0\r\nHost: example.com\r\n\r\n')
+
+        self.assertEqual(self.example_host.get_stats()['status_codes'], {405: 1, 414: 1, 404: 1, 505: 1})
+
+
+
+class HotPathsHandoffTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.server_close()
+            server.drain(5)
+        self.root.cleanup()
+
+    def make_server(self):
+        host = VirtualHost('example.com', self.root.name)
+        server = SimpleHTTPServer(('localhost', 0), VirtualHostMap(VirtualHost('*', './'), [host]), 1)
+        self.servers.append(server)
+        return server, host
+
+    def test_warm_up_from_previous_generation(self):
+        paths = []
+        for name in ('a', 'b'):
+            paths.append(os.path.join(self.root.name, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(name.encode())
+
+        server, host = self.make_server()
+        host.cache.load(paths[1])
+        host.cache.load(paths[0])
+        successors = []
+
+        def spawn_successor(tcp_server, args, env=None):
+            os.environ[HOT_PATHS_ENV] = env[HOT_PATHS_ENV]
+            successor, successor_host = self.make_server()
+            successor.warm_up()
+            successors.append((env[HOT_PATHS_ENV], successor_host))
+            return SimpleNamespace(pid=1)
+
+        with mock.patch.object(TCPServer, 'spawn_successor', spawn_successor):
+            self.assertIsNotNone(server.spawn_successor(['httpd']))
+
+        hot_paths_file, successor_host = successors[0]
+        self.assertEqual(successor_host.cache.hot_paths(), paths)
+        self.assertFalse(os.path.exists(hot_paths_file))
+        self.assertNotIn(HOT_PATHS_ENV, os.environ)
+
+    def test_failed_successor_removes_hot_paths(self):
+        server, _ = self.make_server()
+        hot_paths_files = []
+
+        def spawn_successor(tcp_server, args, env=None):
+            hot_paths_files.append(env[HOT_PATHS_ENV])
+
+        with mock.patch.object(TCPServer, 'spawn_successor', spawn_successor):
+            self.assertIsNone(server.spawn_successor(['httpd']))
+
+        self.assertFalse(os.path.exists(hot_paths_files[0]))
+
+    def test_corrupt_hot_paths_removed(self):
+        fd, hot_paths_file = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            f.write('{"example.com": [')
+
+        server, _ = self.make_server()
+        os.environ[HOT_PATHS_ENV] = hot_paths_file
+        with self.assertLogs(level='ERROR'):
+            server.warm_up()
+
+        self.assertFalse(os.path.exists(hot_paths_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+from collections import Counter
+from configparser import ConfigParser
+
+from file_cache import FileCache
+
+DEFAULT_INDEX_FILE = 'index.html'
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024
+DEFAULT_CACHE_MAX_FILE_SIZE = 1024 * 1024
+# Request lines are read up to this length before the host is known,
+# so max_url_length of a host can only be lower
+MAX_URL_LENGTH = 65536
+
+DEFAULT_HOST_NAME = '*'
+DEFAULT_SECTION = 'DEFAULT'
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self.status_codes = Counter()
+        self.__lock = threading.Lock()
+
+    def record_request(self, code, bytes_sent):
+        with self.__lock:
+            self.requests += 1
+            self.bytes_sent += bytes_sent
+            self.status_codes[code] += 1
+
+    def get_stats(self):
+        with self.__lock:
+            return {
+                'requests': self.requests,
+                'bytes_sent': self.bytes_sent,
+                'status_codes': dict(self.status_codes)
+            }
+
+
+class VirtualHost:
+    def __init__(self, name, document_root, aliases=(), index_file=DEFAULT_INDEX_FILE,
+                 cache_size=DEFAULT_CACHE_SIZE, cache_max_file_size=DEFAULT_CACHE_MAX_FILE_SIZE,
+                 max_url_length=MAX_URL_LENGTH):
+        self.name = name
+        self.aliases = tuple(aliases)
+        self.document_root = document_root
+        self.index_file = index_file
+        self.max_url_length = max_url_length
+        self.cache = FileCache(cache_size, cache_max_file_size)
+        self.stats = HostStats()
+
+    def warm_up(self, hot_paths):
+        """Load files into the cache. hot_paths are ordered from the most recently used."""
+        root = os.path.join(self.document_root, '')
+        for path in reversed(hot_paths):
+            if path.startswith(root):
+                self.cache.load(path)
+
+    def get_stats(self):
+        stats = self.stats.get_stats()
+        stats['cache'] = self.cache.get_stats()
+        return stats
+
+
+class VirtualHostMap:
+    """Routes requests to virtual hosts by the Host header.
+
+    Requests without Host header or with an unknown host are served
+    by the default host.
+    """
+
+    def __init__(self, default_host, hosts=()):
+        self.default_host = default_host
+        self.hosts = [default_host]
+        self.__names = {}
+        for host in hosts:
+            self.add(host)
+
+    def add(self, host):
+        for name in (host.name,) + host.aliases:
+            name = name.lower()
+            if name in self.__names:
+                raise ValueError('Duplicate virtual host name {}'.format(name))
+            self.__names[name] = host
+        self.hosts.append(host)
+
+    def resolve(self, host_header):
+        if not host_header:
+            return self.default_host
+
+        name = host_header.strip().lower()
+        if name.startswith('['):
+            name = name[:name.find(']') + 1]
+        else:
+            name = name.rsplit(':', 1)[0]
+
+        return self.__names.get(name.rstrip('.'), self.default_host)
+
+    def get_stats(self):
+        return {host.name: host.get_stats() for host in self.hosts}
+
+    def get_hot_paths(self):
+        return {host.name: host.cache.hot_paths() for host in self.hosts}
+
+    def warm_up(self, hot_paths):
+        for host in self.hosts:
+            host.warm_up(hot_paths.get(host.name, ()))
+
+
+def read_host_params(name, options):
+    max_url_length = int(options.get('max_url_length', MAX_URL_LENGTH))
+    if max_url_length > MAX_URL_LENGTH:
+        logging.warning('max_url_length {} of host {} is above the server limit, {} is used'
+                        .format(max_url_length, name, MAX_URL_LENGTH))
+        max_url_length = MAX_URL_LENGTH
+
+    return {
+        'index_file': options.get('index', DEFAULT_INDEX_FILE),
+        'cache_size': int(options.get('cache_size', DEFAULT_CACHE_SIZE)),
+        'cache_max_file_size': int(options.get('cache_max_file_size', DEFAULT_CACHE_MAX_FILE_SIZE)),
+        'max_url_length': max_url_length
+    }
+
+
+def load_virtual_hosts(config_path, default_document_root):
+    """Build VirtualHostMap from ini-file where every section describes one host.
+
+    Options of [DEFAULT] section apply to every host including the default one,
+    which serves default_document_root. aliases and document_root are taken
+    only from the host's own section.
+
+        [DEFAULT]
+        cache_size = 8388608
+
+        [example.com]
+        aliases = www.example.com
+        document_root = /var/www/example
+        index = index.htm
+    """
+    default_options = {}
+    hosts = []
+
+    if config_path:
+        # [DEFAULT] is read as an ordinary section, so options are not inherited implicitly
+        parser = ConfigParser(interpolation=None, default_section='')
+        with open(config_path) as f:
+            parser.read_file(f)
+
+        if parser.has_section(DEFAULT_SECTION):
+            default_options = dict(parser[DEFAULT_SECTION])
+            parser.remove_section(DEFAULT_SECTION)
+
+        for name in parser.sections():
+            section = parser[name]
+            options = dict(default_options)
+            options.update(section)
+            hosts.append(VirtualHost(name, section['document_root'],
+                                     aliases=section.get('aliases', '').split(),
+                                     **read_host_params(name, options)))
+
+    default_host = VirtualHost(DEFAULT_HOST_NAME, default_document_root, **read_host_params(DEFAULT_HOST_NAME, default_options))
+    return VirtualHostMap(default_host, hosts)